@@ -16,4 +16,4 @@ sharepoint_response = sharepoint_connection.get_sharepoint_list(tenant_name='the
                                                                 team_id='the team id',
                                                                 list_id='the list id')
                                                 
-print(sharepoint_response.json())
+print(sharepoint_connection.parse(sharepoint_response))
@@ -1,11 +1,59 @@
-from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
-
-from typing import List
-import pytz
-from datetime import datetime
+from functools import lru_cache
+
+from typing import TYPE_CHECKING, Dict, Iterator, List
+import asyncio
+import time
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from urllib.parse import quote
+import aiohttp
+import ijson
 import msal
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+GRAPH_URL = 'https://graph.microsoft.com/v1.0'
+try:
+    SYDNEY_TZ = ZoneInfo('Australia/Sydney')
+except ZoneInfoNotFoundError:
+    # no system tz database (e.g. Windows without the tzdata package), log error times in UTC
+    SYDNEY_TZ = timezone.utc
+# maximum page size requested from Graph on every call, in place of a $top query param
+PREFER_PAGE_SIZE = 'odata.maxpagesize=5000'
+# throttling policy shared by the requests adapter, $batch subrequests and the aiohttp path
+RETRY_STATUSES = frozenset((429, 503, 504))
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.5
+
+def _retry_delay(attempt: int, retry_after: str = None) -> float:
+    '''
+    Seconds to wait before retry number attempt + 1, at least the Retry-After the server asked for
+    '''
+    delay = RETRY_BACKOFF * 2 ** attempt
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, int(retry_after))
+    return delay
+
+@lru_cache(maxsize=64)
+def _build_list_url(tenant_name: str, team_id: str, list_id: str) -> str:
+    '''
+    Items url of a list
+    '''
+    return f'{GRAPH_URL}/sites/{tenant_name}.sharepoint.com:/teams/{team_id}:/lists/{list_id}/items'
+
+@lru_cache(maxsize=64)
+def _build_filter_url(tenant_name: str, team_id: str, list_id: str, column: str) -> str:
+    '''
+    Url filtering a list on column, up to and including the opening quote of the value
+    '''
+    return _build_list_url(tenant_name, team_id, list_id) + '?$expand=fields&$filter=' + quote(f"fields/{column} eq '", safe='')
 
 class SharePointError(Exception):
     '''Exception raised if input json value has empty rows'''
@@ -18,11 +66,16 @@ class Validator(ABC):
     '''
     Validator abstract class
     '''
+    def __set_name__(self, owner, name):
+        # the value lives on each instance, not on the shared descriptor
+        self.private_name = '_' + name
     def __get__(self, obj, objtype=None):
-        return self.value
+        if obj is None:
+            return self
+        return getattr(obj, self.private_name, None)
     def __set__(self, obj, value):
         self.validate(value)
-        self.value = value
+        setattr(obj, self.private_name, value)
     @abstractmethod
     def validate(self, value):
         pass
@@ -31,7 +84,7 @@ class Response(Validator):
     '''
     Http response code validator
     '''
-    valid_response = (requests.codes.ok, 201)
+    valid_response = frozenset((requests.codes.ok, 201))
     def validate(self, response):
         if response.status_code not in Response.valid_response:
             raise InvalidResponseCodeError(
@@ -39,7 +92,6 @@ class Response(Validator):
                 failure=''
             )
 
-@dataclass
 class MicrosoftGraph:
     """
     class used to authenticate MicrosoftGraph Connection and query items
@@ -63,34 +115,66 @@ class MicrosoftGraph:
     password: str
         associated with the username
 
-    response: str = field(init=False, default=Response())
+    response: Response
         the response from the API call
 
     scope: List[str]
         the scope of the API call
 
+    app: msal.ClientApplication
+        the msal application, created lazily on first token request
+
+    session: requests.Session
+        pooled HTTP session, created lazily, reused across Graph calls, carries the Authorization header
+        and retries throttled (429/503/504) requests with exponential backoff
+
     Methods
     -------
     _get_token()
-        generates token
+        generates token, reusing the cached one while it is still valid
+
+    parse(response: requests.models.Response)
+        decodes the json body of a Graph response using orjson
+
+    list_to_dataframe(response: requests.models.Response)
+        flattens the items of a list response into a pandas DataFrame
 
     get_sharepoint_list_item_data(self, tenant_name: str, team_id: str, list_id: str, column: str, value: str)
         retries data from a sharepoint list with a team on sharepoint
 
+    iter_sharepoint_list(self, tenant_name: str, team_id: str, list_id: str, columns: List[str] = None)
+        streams every item of a sharepoint list, following @odata.nextLink across pages
+
+    batch_get_items(self, tenant_name: str, team_id: str, list_id: str, column: str, values: List[str])
+        retrieves the rows matching each value through the Graph $batch endpoint
+
+    aget_sharepoint_list_item_data(self, tenant_name: str, team_id: str, list_id: str, column: str, value: str)
+        async variant of get_sharepoint_list_item_data, returns the decoded json
+
+    aget_sharepoint_list(self, tenant_name: str, team_id: str, list_id: str, columns: List[str] = None)
+        async variant of get_sharepoint_list, returns the decoded json
+
+    gather_items(self, tenant_name: str, team_id: str, list_id: str, column: str, values: List[str])
+        concurrently retrieves the rows matching each value
+
+    aclose()
+        closes the aiohttp session, also done on exit when used as `async with MicrosoftGraph(...)`,
+        async methods called outside such a block open and close their own session
+
     """
-    client_id: str
-    tenant_id: str
-    client_credential: str
-    username: str #might be your email
-    password: str
-    response: str = field(init=False, default=Response())
-    scope: List[str] = field(default_factory=lambda: ['https://graph.microsoft.com/.default'])
-    app: msal.ClientApplication = None
+    __slots__ = (
+        'client_id', 'tenant_id', 'client_credential', 'username', 'password', 'scope',
+        '_app', '_session', '_token', '_token_exp', '_aiosession',
+        '_current_token_id', '_aioloop', '_aiousers', '_token_refresh', '_response'
+    )
+
+    # class-level descriptor, validates every response assigned to self.response
+    response = Response()
 
     def __init__(self, client_id: str, tenant_id: str, client_credential: str, username: str, password: str, scope: List[str]):
         
         """
-        Create an instance of the msal application
+        Store the connection details, the msal application and http session are created on first use
 
         Parameters
         ----------
@@ -119,20 +203,62 @@ class MicrosoftGraph:
         self.username = username
         self.password = password
         self.scope = scope
-
-        if self.app == None:
-    
-            self.app = msal.ClientApplication(
-            
+        self._token = None
+        self._token_exp = 0
+        self._current_token_id = None
+        self._session = None
+        self._aiosession = None
+        self._aioloop = None
+        self._aiousers = 0
+        self._token_refresh = None
+        self._app = None
+
+    @property
+    def app(self) -> msal.ClientApplication:
+        '''
+        msal application, created on first use so constructing MicrosoftGraph makes no network call
+        '''
+        if self._app is None:
+            self._app = msal.ClientApplication(
                 client_id = self.client_id, 
                 authority = f"https://login.microsoftonline.com/{self.tenant_id}/",
-                client_credential = self.client_credential
+                client_credential = self.client_credential,
+                instance_discovery = False
             )
+        return self._app
+
+    @property
+    def session(self) -> requests.Session:
+        '''
+        pooled http session, created on first use
+        '''
+        if self._session is None:
+            session = requests.Session()
+            # back off on Graph throttling, honouring Retry-After when it is sent
+            retries = Retry(
+                total = MAX_RETRIES,
+                backoff_factor = RETRY_BACKOFF,
+                status_forcelist = RETRY_STATUSES,
+                respect_retry_after_header = True,
+                raise_on_status = False,
+                # the only POST sent is a $batch of GETs, so it is safe to repeat
+                allowed_methods = Retry.DEFAULT_ALLOWED_METHODS | {'POST'}
+            )
+            session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries))
+            session.headers['Prefer'] = PREFER_PAGE_SIZE
+            self._session = session
+        return self._session
     
     def _get_token(self) -> str:
         '''
         Grab Graph API token leveraging MSAL library
+
+        The token is cached on the instance and reused until 60 seconds
+        before it expires, so repeated calls skip the MSAL lookup.
         '''
+        if self._token_is_fresh():
+            return self._token
+
         result = None
         accounts = self.app.get_accounts(username=self.username)
         # print(accounts)
@@ -150,7 +276,71 @@ class MicrosoftGraph:
                 scopes=self.scope
             )
         if 'access_token' in result:
-            return result['access_token']
+            self._token = result['access_token']
+            self._token_exp = time.monotonic() + result.get('expires_in', 3600)
+            return self._token
+
+    def _token_is_fresh(self) -> bool:
+        return bool(self._token) and time.monotonic() < self._token_exp - 60
+
+    async def _aget_token(self) -> str:
+        '''
+        Token for the async methods, a cached token is returned without leaving the event loop
+
+        On a miss msal runs in a worker thread since it may refresh over blocking http, and
+        concurrent callers await that single refresh instead of starting their own.
+        '''
+        if self._token_is_fresh():
+            return self._token
+        loop = asyncio.get_running_loop()
+        refresh = self._token_refresh
+        if refresh is None or refresh.done() or refresh.get_loop() is not loop:
+            refresh = self._token_refresh = loop.create_task(asyncio.to_thread(self._get_token))
+        # shield so a cancelled caller does not cancel the refresh shared with the others
+        return await asyncio.shield(refresh)
+
+    def _authorize(self):
+        '''
+        Bind the current token into the session headers, only rebuilding them when the token changes
+        '''
+        token = self._get_token()
+        if token is not self._current_token_id:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+            self._current_token_id = token
+
+    @staticmethod
+    def parse(response: requests.models.Response) -> dict:
+        '''
+        Decode a Graph response body with orjson, faster than response.json()
+        '''
+        return orjson.loads(response.content)
+
+    @staticmethod
+    def list_to_dataframe(response: requests.models.Response) -> 'pd.DataFrame':
+        '''
+        Flatten the items of a list response into a DataFrame, nested fields become "fields.<name>" columns
+        '''
+        # pandas is only needed here, so keep it off the import path of the module
+        import pandas as pd
+        return pd.json_normalize(orjson.loads(response.content)['value'])
+
+    @staticmethod
+    def _list_params(columns: List[str] = None) -> dict:
+        '''
+        Query parameters for a whole-list request, projecting to columns when given
+        '''
+        params = {}
+        if columns:
+            params['$select'] = 'id,webUrl'
+            params['$expand'] = f'fields($select={",".join(columns)})'
+        return params
+
+    @staticmethod
+    def _filter_url(tenant_name: str, team_id: str, list_id: str, column: str, value: str) -> str:
+        '''
+        Url of the rows where column equals value, quotes in value are OData-escaped
+        '''
+        return _build_filter_url(tenant_name, team_id, list_id, column) + quote(value.replace("'", "''"), safe='') + '%27'
 
     def get_sharepoint_list_item_data(self, tenant_name: str, team_id: str, list_id: str, column: str, value: str) -> requests.models.Response:
         
@@ -176,22 +366,19 @@ class MicrosoftGraph:
 
         """
         try:
-            url = f'https://graph.microsoft.com/v1.0/sites/{tenant_name}.sharepoint.com:/teams/{team_id}:/lists/{list_id}/items?$expand=fields&$filter=fields/{column} eq \'{value}\''
+            url = self._filter_url(tenant_name, team_id, list_id, column, value)
 
-            headers={
-                'Authorization': f'Bearer {self._get_token()}'
-            }
+            self._authorize()
 
-            self.response = requests.get(url = url, headers = headers)
+            self.response = self.session.get(url)
 
             if self.response.status_code == 200:
                 return self.response
         except Exception as e:
-            timezone = pytz.timezone('Australia/Sydney')
-            current_time = datetime.now(timezone)
+            current_time = datetime.now(SYDNEY_TZ)
             print(f"SharePoint connection error at: {current_time} with error {e}")
 
-    def get_sharepoint_list(self, tenant_name: str, team_id: str, list_id: str) -> requests.models.Response:
+    def get_sharepoint_list(self, tenant_name: str, team_id: str, list_id: str, columns: List[str] = None) -> requests.models.Response:
         
         """returns data from a sharepoint list with a team on sharepoint - this is a entire list
 
@@ -207,19 +394,268 @@ class MicrosoftGraph:
         list_id: str
             the unique id of the list
 
+        columns: List[str]
+            optional field names to return, only these fields are fetched when given
+
         """
         try:
-            url = f'https://graph.microsoft.com/v1.0/sites/{tenant_name}.sharepoint.com:/teams/{team_id}:/lists/{list_id}/items'
+            url = _build_list_url(tenant_name, team_id, list_id)
             print(url)
-            headers={
-                'Authorization': f'Bearer {self._get_token()}'
-            }
+            self._authorize()
 
-            self.response = requests.get(url = url, headers = headers, params={'expand': 'False', 'top': '4999'})
+            self.response = self.session.get(url, params=self._list_params(columns))
 
             if self.response.status_code == 200:
                 return self.response
         except Exception as e:
-            timezone = pytz.timezone('Australia/Sydney')
-            current_time = datetime.now(timezone)
-            print(f"SharePoint connection error at: {current_time} with error {e}")
\ No newline at end of file
+            current_time = datetime.now(SYDNEY_TZ)
+            print(f"SharePoint connection error at: {current_time} with error {e}")
+
+    def iter_sharepoint_list(self, tenant_name: str, team_id: str, list_id: str, columns: List[str] = None) -> Iterator[dict]:
+
+        """yields every item of a sharepoint list, following @odata.nextLink until the last page
+
+        Each page is stream-parsed so only one item is held in memory at a time.
+        Unlike get_sharepoint_list, failures are raised rather than printed, so a partial
+        list is never mistaken for a complete one: InvalidResponseCodeError for a non-200
+        page, requests exceptions for connection errors.
+
+        Parameters
+        ----------
+
+        tenant_name: str
+            The tenant name, a unique identifier representing the organization (or tenant)
+
+        team_id: str
+            the sharepoint team which contains the list
+
+        list_id: str
+            the unique id of the list
+
+        columns: List[str]
+            optional field names to return, only these fields are fetched when given
+
+        """
+        url = _build_list_url(tenant_name, team_id, list_id)
+        params = self._list_params(columns)
+        while url:
+            self._authorize()
+
+            r = self.session.get(url, params = params, stream = True)
+            # nextLink already carries the query string
+            url, params = None, None
+            builder = None
+            # closing returns the streamed connection to the pool, also when validation fails
+            with r:
+                self.response = r
+                r.raw.decode_content = True
+                for prefix, event, value in ijson.parse(r.raw, use_float = True):
+                    if prefix == '@odata.nextLink':
+                        url = value
+                    elif prefix == 'value.item' and event == 'start_map':
+                        builder = ijson.ObjectBuilder()
+                    if builder is not None:
+                        builder.event(event, value)
+                        if prefix == 'value.item' and event == 'end_map':
+                            yield builder.value
+                            builder = None
+
+    def batch_get_items(self, tenant_name: str, team_id: str, list_id: str, column: str, values: List[str]) -> Dict[str, dict]:
+
+        """returns the rows matching each value, keyed by value, using the Graph $batch endpoint
+
+        Lookups are sent 20 at a time (the $batch limit) so N values cost N/20 round trips.
+        Throttled subrequests (429/503/504) are resent after their Retry-After delay, up to
+        MAX_RETRIES times. Values whose subrequest failed or stayed throttled map to None.
+
+        Parameters
+        ----------
+
+        tenant_name: str
+            The tenant name, a unique identifier representing the organization (or tenant)
+
+        team_id: str
+            the sharepoint team which contains the list
+
+        list_id: str
+            the unique id of the list
+
+        column: str
+            the column name off of which the rows are extracted
+
+        values: List[str]
+            the values of the column to look up
+
+        """
+        results = {}
+        for start in range(0, len(values), 20):
+            # subrequest id -> value, throttled subrequests are resent with their original id
+            pending = dict(enumerate(values[start:start + 20]))
+            for attempt in range(MAX_RETRIES + 1):
+                body = {
+                    'requests': [
+                        {
+                            'id': str(i),
+                            'method': 'GET',
+                            'url': self._filter_url(tenant_name, team_id, list_id, column, v)[len(GRAPH_URL):]
+                        }
+                        for i, v in pending.items()
+                    ]
+                }
+                try:
+                    self._authorize()
+
+                    self.response = self.session.post(f'{GRAPH_URL}/$batch', json = body)
+                except Exception as e:
+                    current_time = datetime.now(SYDNEY_TZ)
+                    print(f"SharePoint connection error at: {current_time} with error {e}")
+                    results.update(dict.fromkeys(pending.values()))
+                    break
+
+                throttled = {}
+                delay = 0
+                for sub in self.parse(self.response)['responses']:
+                    i = int(sub['id'])
+                    if sub.get('status') in RETRY_STATUSES and attempt < MAX_RETRIES:
+                        throttled[i] = pending[i]
+                        retry_after = CaseInsensitiveDict(sub.get('headers') or {}).get('Retry-After')
+                        delay = max(delay, _retry_delay(attempt, retry_after))
+                    else:
+                        results[pending[i]] = sub.get('body') if sub.get('status') == 200 else None
+                if not throttled:
+                    break
+                time.sleep(delay)
+                pending = throttled
+        return results
+
+    async def aclose(self):
+        '''
+        Close the aiohttp session used by the async methods
+        '''
+        if self._aiosession is not None:
+            await self._aiosession.close()
+            self._aiosession = None
+            self._aioloop = None
+            self._aiousers = 0
+
+    async def __aenter__(self):
+        '''
+        Open the aiohttp session, or join the one already open on this event loop
+
+        Each async method enters the instance itself, so a standalone call gets a session
+        that is closed when it returns, while `async with MicrosoftGraph(...)` keeps one
+        session open across all calls inside the block.
+        '''
+        loop = asyncio.get_running_loop()
+        if self._aiosession is None:
+            self._aioloop = loop
+            self._aiosession = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit_per_host=64),
+                headers = {'Prefer': PREFER_PAGE_SIZE}
+            )
+        elif self._aioloop is not loop:
+            raise RuntimeError('the aiohttp session is open on another event loop, close it with aclose() there first')
+        self._aiousers += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self._aiousers -= 1
+        if self._aiousers == 0:
+            await self.aclose()
+
+    async def _aget_json(self, url: str, params: dict = None) -> dict:
+        '''
+        GET url and decode the json, throttled responses are retried like the requests session does
+        '''
+        try:
+            headers = {'Authorization': f'Bearer {await self._aget_token()}'}
+
+            async with self:
+                for attempt in range(MAX_RETRIES + 1):
+                    async with self._aiosession.get(url, headers = headers, params = params) as r:
+                        if r.status == 200:
+                            return await r.json(loads = orjson.loads)
+                        if r.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                            raise InvalidResponseCodeError(response_code = r.status, failure = '')
+                        delay = _retry_delay(attempt, r.headers.get('Retry-After'))
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            current_time = datetime.now(SYDNEY_TZ)
+            print(f"SharePoint connection error at: {current_time} with error {e}")
+
+    async def aget_sharepoint_list_item_data(self, tenant_name: str, team_id: str, list_id: str, column: str, value: str) -> dict:
+
+        """async variant of get_sharepoint_list_item_data, returns the decoded json
+
+        Parameters
+        ----------
+
+        tenant_name: str
+            The tenant name, a unique identifier representing the organization (or tenant)
+
+        team_id: str
+            the sharepoint team which contains the list
+
+        list_id: str
+            the unique id of the list
+
+        column: str
+            the column name off of which the row is extracted
+
+        value: str
+            the value of the column
+
+        """
+        url = self._filter_url(tenant_name, team_id, list_id, column, value)
+        return await self._aget_json(url)
+
+    async def aget_sharepoint_list(self, tenant_name: str, team_id: str, list_id: str, columns: List[str] = None) -> dict:
+
+        """async variant of get_sharepoint_list, returns the decoded json
+
+        Parameters
+        ----------
+
+        tenant_name: str
+            The tenant name, a unique identifier representing the organization (or tenant)
+
+        team_id: str
+            the sharepoint team which contains the list
+
+        list_id: str
+            the unique id of the list
+
+        columns: List[str]
+            optional field names to return, only these fields are fetched when given
+
+        """
+        url = _build_list_url(tenant_name, team_id, list_id)
+        return await self._aget_json(url, params=self._list_params(columns))
+
+    async def gather_items(self, tenant_name: str, team_id: str, list_id: str, column: str, values: List[str]) -> List[dict]:
+
+        """concurrently retrieves the rows matching each value, results are in the order of values
+
+        Parameters
+        ----------
+
+        tenant_name: str
+            The tenant name, a unique identifier representing the organization (or tenant)
+
+        team_id: str
+            the sharepoint team which contains the list
+
+        list_id: str
+            the unique id of the list
+
+        column: str
+            the column name off of which the rows are extracted
+
+        values: List[str]
+            the values of the column to look up
+
+        """
+        # share one session across the fan-out
+        async with self:
+            tasks = [self.aget_sharepoint_list_item_data(tenant_name, team_id, list_id, column, v) for v in values]
+            return await asyncio.gather(*tasks)
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+
+import sharepoint
+
+
+class _GraphHandler(BaseHTTPRequestHandler):
+    '''
+    Hands each request to server.route(method, path, body), which returns (status, body, headers)
+    '''
+    def do_GET(self):
+        self._reply('GET', None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._reply('POST', json.loads(self.rfile.read(length)))
+
+    def _reply(self, method, body):
+        self.server.requests.append((method, self.path, body))
+        status, payload, headers = self.server.route(method, self.path, body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Graph(sharepoint.MicrosoftGraph):
+    __slots__ = ()
+
+    def _get_token(self):
+        return 'token'
+
+
+@pytest.fixture
+def server(monkeypatch):
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), _GraphHandler)
+    srv.requests = []
+    srv.route = lambda method, path, body: (404, {}, None)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    srv.base_url = f'http://127.0.0.1:{srv.server_port}'
+    monkeypatch.setattr(sharepoint, 'GRAPH_URL', srv.base_url)
+    sharepoint._build_list_url.cache_clear()
+    sharepoint._build_filter_url.cache_clear()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+    sharepoint._build_list_url.cache_clear()
+    sharepoint._build_filter_url.cache_clear()
+
+
+@pytest.fixture
+def graph():
+    return _Graph('client', 'tenant', 'secret', 'user', 'password', ['Sites.Read.All'])
+
+
+def test_async_session_follows_the_running_loop(server, graph):
+    server.route = lambda method, path, body: (200, {'value': [{'id': '1'}]}, None)
+
+    async def lookup():
+        return await graph.gather_items('t', 'team', 'list', 'Title', ['a'])
+
+    async def lookup_and_close():
+        async with graph:
+            return await lookup()
+
+    # standalone calls close their own session, so a later loop never sees a stale one
+    assert asyncio.run(lookup()) == [{'value': [{'id': '1'}]}]
+    assert asyncio.run(lookup()) == [{'value': [{'id': '1'}]}]
+    assert asyncio.run(lookup_and_close()) == [{'value': [{'id': '1'}]}]
+    assert graph._aiosession is None
+
+
+def test_async_with_keeps_one_session_open(server, graph):
+    server.route = lambda method, path, body: (200, {'value': []}, None)
+
+    async def lookups():
+        async with graph:
+            session = graph._aiosession
+            await graph.aget_sharepoint_list('t', 'team', 'list')
+            await graph.gather_items('t', 'team', 'list', 'Title', ['a', 'b'])
+            assert graph._aiosession is session and not session.closed
+        return session
+
+    assert asyncio.run(lookups()).closed
+
+
+def _paged_list(server, second_page_status=200):
+    def route(method, path, body):
+        if path.endswith('/page2'):
+            return second_page_status, {'value': [{'id': '3', 'fields': {'Score': 2.5}}]}, None
+        return 200, {
+            '@odata.nextLink': f'{server.base_url}/page2',
+            'value': [{'id': '1', 'fields': {'Score': 1}}, {'id': '2', 'fields': {'Score': 0.5}}]
+        }, None
+    server.route = route
+
+
+def test_iter_sharepoint_list_follows_next_link(server, graph):
+    _paged_list(server)
+
+    items = list(graph.iter_sharepoint_list('t', 'team', 'list'))
+
+    assert [item['id'] for item in items] == ['1', '2', '3']
+    assert [path for _, path, _ in server.requests] == ['/sites/t.sharepoint.com:/teams/team:/lists/list/items', '/page2']
+
+
+def test_iter_sharepoint_list_decodes_floats_like_parse(server, graph):
+    _paged_list(server)
+
+    scores = [item['fields']['Score'] for item in graph.iter_sharepoint_list('t', 'team', 'list')]
+
+    assert scores == [1, 0.5, 2.5]
+    assert [type(score) for score in scores] == [int, float, float]
+
+
+def test_iter_sharepoint_list_raises_when_a_later_page_fails(server, graph):
+    _paged_list(server, second_page_status=401)
+    items = []
+
+    with pytest.raises(sharepoint.InvalidResponseCodeError):
+        for item in graph.iter_sharepoint_list('t', 'team', 'list'):
+            items.append(item)
+
+    assert [item['id'] for item in items] == ['1', '2']
+
+
+def _filter_value(url):
+    # the value between the quotes of "fields/<column> eq '<value>'", OData quoting undone
+    return unquote(url).split(" eq '", 1)[1][:-1].replace("''", "'")
+
+
+def _batch_reply(method, path, body):
+    return 200, {
+        'responses': [
+            {'id': sub['id'], 'status': 200, 'body': {'value': [{'fields': {'Title': _filter_value(sub['url'])}}]}}
+            for sub in body['requests']
+        ]
+    }, None
+
+
+def test_batch_get_items_sends_twenty_lookups_per_request(server, graph):
+    server.route = _batch_reply
+    values = [f'v{i}' for i in range(45)]
+
+    results = graph.batch_get_items('t', 'team', 'list', 'Title', values)
+
+    assert [len(body['requests']) for _, _, body in server.requests] == [20, 20, 5]
+    assert all(path == '/$batch' for _, path, _ in server.requests)
+    assert {value: result['value'][0]['fields']['Title'] for value, result in results.items()} == {v: v for v in values}
+
+
+def test_batch_get_items_retries_throttled_subrequests(server, graph):
+    def route(method, path, body):
+        if len(server.requests) > 1:
+            return _batch_reply(method, path, body)
+        return 200, {
+            'responses': [
+                {'id': '0', 'status': 429, 'headers': {'Retry-After': '0'}, 'body': {}},
+                {'id': '1', 'status': 200, 'body': {'value': []}},
+                {'id': '2', 'status': 404, 'body': {}},
+            ]
+        }, None
+    server.route = route
+
+    results = graph.batch_get_items('t', 'team', 'list', 'Title', ['a', 'b', 'c'])
+
+    assert [sub['id'] for sub in server.requests[1][2]['requests']] == ['0']
+    assert results == {'a': {'value': [{'fields': {'Title': 'a'}}]}, 'b': {'value': []}, 'c': None}
+
+
+@pytest.mark.parametrize('value', ["O'Brien", "it''s", 'a & b', 'x/y?z=1#frag', '50% off', 'café'])
+def test_item_lookup_escapes_the_filter_value(server, graph, value):
+    server.route = lambda method, path, body: (200, {'value': [{'id': '1'}]}, None)
+
+    graph.get_sharepoint_list_item_data('t', 'team', 'list', 'Title', value)
+
+    _, path, _ = server.requests[0]
+    base, query = path.split('?', 1)
+    assert base == '/sites/t.sharepoint.com:/teams/team:/lists/list/items'
+    # nothing in the value may leak into the query structure
+    assert query.count('&') == 1 and '#' not in query and "'" not in query
+    assert unquote(query) == f"$expand=fields&$filter=fields/Title eq '{value.replace(chr(39), chr(39) * 2)}'"
+    assert _filter_value(path) == value
+
+
+def test_filter_url_reuses_the_cached_prefix(server):
+    first = sharepoint.MicrosoftGraph._filter_url('t', 'team', 'list', 'Title', 'a')
+    second = sharepoint.MicrosoftGraph._filter_url('t', 'team', 'list', 'Title', 'b')
+
+    prefix = sharepoint._build_list_url('t', 'team', 'list') + '?$expand=fields&$filter=fields%2FTitle%20eq%20%27'
+    assert (first, second) == (prefix + 'a%27', prefix + 'b%27')
+    assert sharepoint._build_filter_url.cache_info().hits == 1
+    assert sharepoint._build_list_url.cache_info().currsize == 1
+
+
+class _CountingGraph(sharepoint.MicrosoftGraph):
+    '''
+    Caches its token like the msal path does and counts the acquisitions
+    '''
+    __slots__ = ()
+    acquisitions = 0
+
+    def _get_token(self):
+        if self._token_is_fresh():
+            return self._token
+        type(self).acquisitions += 1
+        time.sleep(0.05)
+        self._token, self._token_exp = 'token', time.monotonic() + 3600
+        return self._token
+
+
+def test_gather_items_acquires_the_token_once(server):
+    server.route = lambda method, path, body: (200, {'value': []}, None)
+    graph = _CountingGraph('client', 'tenant', 'secret', 'user', 'password', ['Sites.Read.All'])
+    _CountingGraph.acquisitions = 0
+
+    results = asyncio.run(graph.gather_items('t', 'team', 'list', 'Title', [str(i) for i in range(50)]))
+
+    assert results == [{'value': []}] * 50
+    assert _CountingGraph.acquisitions == 1
+
+
+def test_async_token_failure_is_reported_like_the_sync_path(server, capsys):
+    class _FailingGraph(sharepoint.MicrosoftGraph):
+        __slots__ = ()
+
+        def _get_token(self):
+            raise RuntimeError('aad unavailable')
+
+    graph = _FailingGraph('client', 'tenant', 'secret', 'user', 'password', ['Sites.Read.All'])
+
+    assert asyncio.run(graph.gather_items('t', 'team', 'list', 'Title', ['a', 'b'])) == [None, None]
+    assert graph.get_sharepoint_list_item_data('t', 'team', 'list', 'Title', 'a') is None
+    assert capsys.readouterr().out.count('aad unavailable') == 3
+    assert server.requests == []
+
+
+def test_retry_delay_backs_off_and_honours_retry_after():
+    assert [sharepoint._retry_delay(attempt) for attempt in range(4)] == [0.5, 1, 2, 4]
+    assert sharepoint._retry_delay(0, '3') == 3
+    assert sharepoint._retry_delay(3, '1') == 4
+    assert sharepoint._retry_delay(0, 'Wed, 21 Oct 2015 07:28:00 GMT') == 0.5
+
+
+def test_async_lookup_retries_throttled_responses(server, graph, monkeypatch):
+    monkeypatch.setattr(sharepoint, 'RETRY_BACKOFF', 0)
+    statuses = iter([429, 503, 200])
+    server.route = lambda method, path, body: (next(statuses), {'value': [{'id': '1'}]}, {'Retry-After': '0'})
+
+    result = asyncio.run(graph.aget_sharepoint_list_item_data('t', 'team', 'list', 'Title', 'a'))
+
+    assert result == {'value': [{'id': '1'}]}
+    assert len(server.requests) == 3
+
+
+def test_async_lookup_reports_throttling_after_the_last_retry(server, graph, monkeypatch, capsys):
+    monkeypatch.setattr(sharepoint, 'RETRY_BACKOFF', 0)
+    server.route = lambda method, path, body: (429, {}, None)
+
+    assert asyncio.run(graph.aget_sharepoint_list('t', 'team', 'list')) is None
+    assert len(server.requests) == sharepoint.MAX_RETRIES + 1
+    assert 'Invalid response code: 429!' in capsys.readouterr().out
+
+
+def test_async_lookup_does_not_retry_other_errors(server, graph, capsys):
+    server.route = lambda method, path, body: (404, {}, None)
+
+    assert asyncio.run(graph.aget_sharepoint_list('t', 'team', 'list')) is None
+    assert len(server.requests) == 1
+    assert 'Invalid response code: 404!' in capsys.readouterr().out
+
+
+class _StatusResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_response_is_stored_per_instance():
+    first = _Graph('client', 'tenant', 'secret', 'user', 'password', ['Sites.Read.All'])
+    second = _Graph('client', 'tenant', 'secret', 'user', 'password', ['Sites.Read.All'])
+    ok = _StatusResponse(200)
+
+    first.response = ok
+
+    assert first.response is ok
+    assert second.response is None
+
+
+def test_invalid_response_is_rejected_and_keeps_the_previous_one(graph):
+    created = _StatusResponse(201)
+    graph.response = created
+
+    with pytest.raises(sharepoint.InvalidResponseCodeError):
+        graph.response = _StatusResponse(404)
+
+    assert graph.response is created